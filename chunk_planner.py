@@ -0,0 +1,301 @@
+import os
+import heapq
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import defaultdict, deque, OrderedDict
+
+from schema_chunk import get_property_token_count, batch_properties
+
+
+DEFAULT_THRESHOLD = 10000
+# Thresholds tried when planning; the schema's total size is added per request
+# so "everything in one chunk" is always a candidate.
+CANDIDATE_THRESHOLDS = [1000, 2000, 3000, 5000, 7500, 10000, 15000, 20000, 30000, 50000]
+# Below this many successful calls for a model we keep DEFAULT_THRESHOLD.
+MIN_SAMPLES = 5
+# Only the most recent calls per model are used for fitting.
+MAX_SAMPLES = 500
+# Per-call failure rate is capped so a flaky model still yields a finite estimate.
+MAX_FAILURE_RATE = 0.9
+# Starting guess at the size of a token for files we can't tokenize locally
+# (e.g. PDFs), until calls on that file type have been observed.
+BINARY_BYTES_PER_TOKEN = 8
+# Documents whose observed prompt size is remembered (least recently used dropped).
+MAX_DOCUMENTS = 1000
+
+
+def document_fingerprint(file_path):
+    """ (sha256 digest, MIME type, size in bytes) identifying a document. """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    mime_type, _ = mimetypes.guess_type(file_path)
+    return digest.hexdigest(), mime_type, os.path.getsize(file_path)
+
+
+def get_property_token_counts(schema, tokenizer):
+    """ Resolved token count of every top-level property in `schema`. """
+    properties = schema.get('properties')
+    if not isinstance(properties, dict):
+        return {}
+    return {
+        prop_name: get_property_token_count(prop_definition, schema, tokenizer)
+        for prop_name, prop_definition in properties.items()
+    }
+
+
+def _ols(xs, ys):
+    """ Least squares fit of ys = intercept + slope * xs, both clamped at 0. """
+    n = len(xs)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x > 0:
+        cov_xy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+        slope = max(cov_xy / var_x, 0.0)
+    else:
+        slope = 0.0
+    return max(mean_y - slope * mean_x, 0.0), slope
+
+
+def _ols2(x1s, x2s, ys):
+    """
+    Least squares fit of ys = intercept + b1 * x1s + b2 * x2s with all
+    coefficients clamped at 0. If the regressors are collinear, or one slope
+    comes out negative, falls back to the better single-regressor fit.
+    """
+    n = len(ys)
+    m1, m2, my = sum(x1s) / n, sum(x2s) / n, sum(ys) / n
+    s11 = sum((a - m1) ** 2 for a in x1s)
+    s22 = sum((b - m2) ** 2 for b in x2s)
+    s12 = sum((a - m1) * (b - m2) for a, b in zip(x1s, x2s))
+    s1y = sum((a - m1) * (y - my) for a, y in zip(x1s, ys))
+    s2y = sum((b - m2) * (y - my) for b, y in zip(x2s, ys))
+    det = s11 * s22 - s12 ** 2
+
+    if det > 1e-9 * s11 * s22:
+        b1 = (s22 * s1y - s12 * s2y) / det
+        b2 = (s11 * s2y - s12 * s1y) / det
+        if b1 >= 0 and b2 >= 0:
+            return max(my - b1 * m1 - b2 * m2, 0.0), b1, b2
+
+    def sse(intercept, b1, b2):
+        return sum((y - intercept - b1 * a - b2 * b) ** 2 for a, b, y in zip(x1s, x2s, ys))
+
+    c1, b1 = _ols(x1s, ys)
+    c2, b2 = _ols(x2s, ys)
+    return min((c1, b1, 0.0), (c2, 0.0, b2), key=lambda fit: sse(*fit))
+
+
+class ChunkPlanner:
+    """
+    Records per-call latency, token usage and failures for each model and
+    picks the chunk threshold that minimizes expected end-to-end latency.
+
+    Each call's prompt is the document plus its chunk tokens: everything else
+    sent with it (instructions and the schema chunk as serialized into the
+    prompt). Chunks are planned by schema tokens, the per-property counts
+    that batching uses. Per model three fits are kept:
+        call_latency      = base_latency
+                            + prefill_latency_per_token * prompt_tokens
+                            + decode_latency_per_token * completion_tokens
+        chunk_tokens      = chunk_base_tokens
+                            + chunk_tokens_per_schema_token * schema_tokens
+        completion_tokens = output_base_tokens
+                            + output_tokens_per_schema_token * schema_tokens
+    since the output grows with the chunk being filled. A request's latency
+    is the makespan of its calls over `concurrency` workers. One failed chunk
+    fails the whole request, so a request of n chunks succeeds with probability
+    (1 - failure_rate) ** n; the makespan is divided by that to get the
+    expected latency of retrying the request until it succeeds.
+    """
+
+    def __init__(self, default_threshold=DEFAULT_THRESHOLD,
+                 candidate_thresholds=CANDIDATE_THRESHOLDS,
+                 min_samples=MIN_SAMPLES, max_samples=MAX_SAMPLES):
+        self.default_threshold = default_threshold
+        self.candidate_thresholds = list(candidate_thresholds)
+        self.min_samples = min_samples
+        self._samples = defaultdict(lambda: deque(maxlen=max_samples))
+        # digest -> [sum, count] of document tokens observed by the provider
+        self._documents = OrderedDict()
+        # MIME type -> [bytes, tokens] observed, for calibrating size estimates
+        self._type_totals = defaultdict(lambda: [0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, model, latency, prompt_tokens=None, completion_tokens=None,
+               chunk_tokens=None, schema_tokens=None, success=True):
+        """
+        Records one LLM call. Token counts may be None for failed calls.
+        `chunk_tokens` counts everything sent except the document;
+        `schema_tokens` is the chunk's size as batching measures it.
+        """
+        with self._lock:
+            self._samples[model].append(
+                (latency, prompt_tokens, completion_tokens, chunk_tokens, schema_tokens, success))
+
+    def observe_document(self, fingerprint, document_tokens):
+        """
+        Records how many prompt tokens a document took, as reported by the
+        provider (a call's prompt tokens minus its chunk tokens). Repeated
+        observations are averaged, so the order calls finish in doesn't matter.
+        """
+        digest, mime_type, size_bytes = fingerprint
+        with self._lock:
+            observed = self._documents.setdefault(digest, [0, 0])
+            observed[0] += document_tokens
+            observed[1] += 1
+            self._documents.move_to_end(digest)
+            while len(self._documents) > MAX_DOCUMENTS:
+                self._documents.popitem(last=False)
+            totals = self._type_totals[mime_type]
+            totals[0] += size_bytes
+            totals[1] += document_tokens
+
+    def estimate_document_tokens(self, fingerprint, file_path, tokenizer):
+        """
+        Estimates how many prompt tokens the document contributes to each
+        call, on the same scale as the provider's `prompt_tokens` the latency
+        model is fitted on. A document seen before reuses its mean observed
+        size; new text files are tokenized, as they are sent verbatim (the
+        instructions around them count as chunk tokens); other files (PDFs
+        etc.) are converted by the provider, so their size comes from the
+        bytes-per-token observed for that file type.
+        """
+        digest, mime_type, size_bytes = fingerprint
+        with self._lock:
+            if digest in self._documents:
+                self._documents.move_to_end(digest)
+                observed_sum, observed_count = self._documents[digest]
+                return round(observed_sum / observed_count)
+            size_totals, token_totals = self._type_totals.get(mime_type, (0, 0))
+
+        if mime_type != "application/pdf":
+            try:
+                with open(file_path, "r", encoding="utf-8") as f:
+                    return len(tokenizer.encode(f.read()))
+            except UnicodeDecodeError:
+                pass
+        if token_totals > 0:
+            return round(size_bytes * token_totals / size_totals)
+        return size_bytes // BINARY_BYTES_PER_TOKEN
+
+    def fit(self, model):
+        """
+        Returns the fitted latency model for `model` as a dict, or None if
+        there are fewer than `min_samples` successful calls to fit from.
+        """
+        with self._lock:
+            samples = list(self._samples.get(model, ()))
+
+        points = [sample[:5] for sample in samples
+                  if sample[5] and None not in sample[1:5]]
+        if len(points) < self.min_samples:
+            return None
+
+        latencies, prompts, completions, chunks, schemas = (list(column) for column in zip(*points))
+        base_latency, prefill_latency, decode_latency = _ols2(prompts, completions, latencies)
+        chunk_base, chunk_per_schema_token = _ols(schemas, chunks)
+        output_base, output_per_schema_token = _ols(schemas, completions)
+
+        failures = sum(1 for sample in samples if not sample[5])
+        return {
+            "base_latency": base_latency,
+            "prefill_latency_per_token": prefill_latency,
+            "decode_latency_per_token": decode_latency,
+            "chunk_base_tokens": chunk_base,
+            "chunk_tokens_per_schema_token": chunk_per_schema_token,
+            "output_base_tokens": output_base,
+            "output_tokens_per_schema_token": output_per_schema_token,
+            "failure_rate": failures / len(samples),
+            "samples": len(samples),
+        }
+
+    def call_latency(self, fitted, document_tokens, schema_tokens):
+        """ Predicted latency of one call for a chunk of `schema_tokens`. """
+        chunk_tokens = (fitted["chunk_base_tokens"]
+                        + fitted["chunk_tokens_per_schema_token"] * schema_tokens)
+        completion_tokens = (fitted["output_base_tokens"]
+                             + fitted["output_tokens_per_schema_token"] * schema_tokens)
+        return (fitted["base_latency"]
+                + fitted["prefill_latency_per_token"] * (document_tokens + chunk_tokens)
+                + fitted["decode_latency_per_token"] * completion_tokens)
+
+    def expected_latency(self, fitted, document_tokens, schema_token_counts, concurrency):
+        """
+        Expected latency of a request with one call per entry of
+        `schema_token_counts`: the makespan over `concurrency` workers, scaled
+        up by the chance that any one of the calls fails the request.
+        """
+        call_latencies = sorted(
+            (self.call_latency(fitted, document_tokens, schema_tokens)
+             for schema_tokens in schema_token_counts),
+            reverse=True,
+        )
+        # Longest-first onto the least loaded worker
+        workers = [0.0] * max(1, min(concurrency, len(call_latencies)))
+        for latency in call_latencies:
+            heapq.heappush(workers, heapq.heappop(workers) + latency)
+
+        failure_rate = min(fitted["failure_rate"], MAX_FAILURE_RATE)
+        success_rate = (1 - failure_rate) ** len(call_latencies)
+        return max(workers) / success_rate
+
+    def choose_threshold(self, model, prop_token_counts, document_tokens, concurrency,
+                         sort_props=True):
+        """
+        Picks the threshold minimizing expected latency for a schema with
+        the given per-property token counts (see `get_property_token_counts`),
+        document size and concurrency. Falls back to `default_threshold`
+        while the model has too few observations.
+        """
+        fitted = self.fit(model)
+        if fitted is None or not prop_token_counts:
+            return self.default_threshold
+
+        property_names = list(prop_token_counts.keys())
+        if sort_props:
+            property_names.sort()
+
+        total_tokens = sum(prop_token_counts.values())
+        candidates = sorted(set(self.candidate_thresholds) | {self.default_threshold, max(total_tokens, 1)})
+
+        best = None
+        for threshold in candidates:
+            batches = batch_properties(property_names, prop_token_counts, threshold)
+            schema_token_counts = [sum(prop_token_counts[p] for p in batch) for batch in batches]
+            latency = self.expected_latency(fitted, document_tokens, schema_token_counts, concurrency)
+            # Ties go to fewer calls, i.e. fewer repeated document prefixes
+            key = (latency, len(batches))
+            if best is None or key < best[0]:
+                best = (key, threshold)
+
+        (latency, num_chunks), threshold = best
+        logging.info(f"Planner chose threshold {threshold} for model '{model}' "
+                     f"({num_chunks} chunks, expected latency {latency:.2f}s).")
+        return threshold
+
+    def describe(self):
+        """ Fitted model (or None if not enough data yet) for every observed model, and
+        the bytes-per-token observed for each file type. """
+        with self._lock:
+            models = list(self._samples.keys())
+            bytes_per_token = {
+                str(mime_type): size_totals / token_totals
+                for mime_type, (size_totals, token_totals) in self._type_totals.items()
+                if token_totals > 0
+            }
+        return {
+            "default_threshold": self.default_threshold,
+            "min_samples": self.min_samples,
+            "models": {model: self.fit(model) for model in models},
+            "bytes_per_token": bytes_per_token,
+        }
+
+
+# Shared planner fed and consulted by main.format
+planner = ChunkPlanner()
+
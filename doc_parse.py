@@ -8,16 +8,15 @@ from google.genai import types
 import os
 import time
 import concurrent.futures
-from llm import gpt_file
+from llm import gpt_file, DEFAULT_MODEL
 
 
 load_dotenv()
     
     
-def extract_document(file_path, schema):
-    print(f"Extracting document from {file_path}")
-
-    extract_document_prompt = f"""
+def build_extract_prompt(schema):
+    """ The extraction prompt sent alongside the document for one schema chunk. """
+    return f"""
     Review the provided file content. Extract the relevant information based on the
     JSON schema structure expected in the output format configuration.
     Ensure the output strictly adheres to the schema. 
@@ -30,7 +29,13 @@ def extract_document(file_path, schema):
     {schema}
     """
 
-    result = gpt_file(extract_document_prompt, file_path)
+
+def extract_document(file_path, schema, model=DEFAULT_MODEL, on_call=None, file_id=None):
+    print(f"Extracting document from {file_path}")
+
+    extract_document_prompt = build_extract_prompt(schema)
+
+    result = gpt_file(extract_document_prompt, file_path, model=model, on_call=on_call, file_id=file_id)
     
     return result
     
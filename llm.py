@@ -3,12 +3,40 @@ from openai import OpenAI
 from dotenv import load_dotenv
 import mimetypes
 import json
+import time
 
 
 load_dotenv()
 
 
-def gpt_file(prompt: str, file_path: str) -> dict:
+DEFAULT_MODEL = "gpt-4.1"
+# Models callers may request; anything else is rejected before any API call
+SUPPORTED_MODELS = ("gpt-4.1", "gpt-4.1-mini", "gpt-4.1-nano", "gpt-4o", "gpt-4o-mini")
+SYSTEM_PROMPT = "You are a JSON generator.  Always reply with exactly one JSON object, no extra text."
+
+
+def upload_document(file_path: str):
+    """
+    Uploads a PDF so several calls can share it, returning its file id.
+    Returns None for other files, which are sent inline as text.
+    """
+    mime_type, _ = mimetypes.guess_type(file_path)
+    if mime_type != "application/pdf":
+        return None
+
+    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    with open(file_path, "rb") as f:
+        uploaded = client.files.create(file=f, purpose="user_data")
+    return uploaded.id
+
+
+def gpt_file(prompt: str, file_path: str, model: str = DEFAULT_MODEL, on_call=None, file_id=None) -> dict:
+    """
+    `file_id` reuses a PDF already uploaded with `upload_document` instead of
+    uploading it again. `on_call(latency, usage, success)` is invoked once the
+    chat completion has been attempted, with its latency and the response's
+    token usage (None if the call failed).
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     client  = OpenAI(api_key=api_key)
 
@@ -20,11 +48,12 @@ def gpt_file(prompt: str, file_path: str) -> dict:
 
     # 2. Upload PDF if needed, else inline text
     if mime_type == "application/pdf":
-        with open(file_path, "rb") as f:
-            uploaded = client.files.create(file=f, purpose="user_data")
+        if file_id is None:
+            with open(file_path, "rb") as f:
+                file_id = client.files.create(file=f, purpose="user_data").id
         user_payload.append({
             "type": "file",
-            "file": { "file_id": uploaded.id }
+            "file": { "file_id": file_id }
         })
     else:
         with open(file_path, "r", encoding="utf-8") as f:
@@ -41,15 +70,27 @@ def gpt_file(prompt: str, file_path: str) -> dict:
     })
 
     # 4. Send chat completion with a system instruction
-    response = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=[
-            {"role": "system", "content": "You are a JSON generator.  Always reply with exactly one JSON object, no extra text."},
-            {"role": "user",   "content": user_payload}
-        ],
-        temperature=0.0,
-    )
-
-    # 5. Parse and return as Python dict
-    raw = response.choices[0].message.content
-    return json.loads(raw)
+    start = time.perf_counter()
+    usage = None
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user",   "content": user_payload}
+            ],
+            temperature=0.0,
+        )
+        latency = time.perf_counter() - start
+        usage = response.usage
+
+        # 5. Parse and return as Python dict
+        raw = response.choices[0].message.content
+        result = json.loads(raw)
+    except Exception:
+        if on_call is not None:
+            on_call(time.perf_counter() - start, usage, False)
+        raise
+    if on_call is not None:
+        on_call(latency, usage, True)
+    return result
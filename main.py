@@ -5,25 +5,51 @@ import json
 import tempfile
 import shutil
 import os
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from typing import List, Dict, Any
+import concurrent.futures
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from typing import List, Dict, Any, Optional
 import tiktoken
 
 
 
-from doc_parse import extract_document, convert_schema_to_json
+from doc_parse import extract_document, convert_schema_to_json, build_extract_prompt
 from schema_chunk import create_schema_chunks, get_token_count
+from chunk_planner import planner, document_fingerprint, get_property_token_counts
+from llm import DEFAULT_MODEL, SUPPORTED_MODELS, SYSTEM_PROMPT, upload_document
 
 
+TOKENIZER_NAME = "cl100k_base"
+# Max extraction calls in flight for a single request
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
 
 
-def format(input_file, schema_json):
+def format(input_file, schema_json, threshold=None, model=DEFAULT_MODEL, concurrency=DEFAULT_CONCURRENCY):
     # schema_json = convert_schema_to_json(schema)
+    if model not in SUPPORTED_MODELS:
+        raise ValueError(f"Unsupported model '{model}'. Choose one of: {', '.join(SUPPORTED_MODELS)}.")
+    concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+
+    tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
+    prop_token_counts = get_property_token_counts(schema_json, tokenizer)
+    fingerprint = document_fingerprint(input_file)
+
+    # Let the planner pick the threshold from observed latencies unless overridden
+    if threshold is None:
+        document_tokens = planner.estimate_document_tokens(fingerprint, input_file, tokenizer)
+        threshold = planner.choose_threshold(
+            model,
+            prop_token_counts,
+            document_tokens,
+            concurrency
+        )
+
     generated_chunks = create_schema_chunks(
         schema_json,
-        tokenizer_name="cl100k_base",
-        threshold=10000,
-        sort_props=True
+        tokenizer_name=TOKENIZER_NAME,
+        threshold=threshold,
+        sort_props=True,
+        prop_token_counts=prop_token_counts
     )
     
     
@@ -49,12 +75,37 @@ def format(input_file, schema_json):
     # else:
     #     print("No schema chunks were generated.")
     
-    chunked_output = []
-    
-    
-    for chunk in generated_chunks:
-        chunked_output.append(extract_document(input_file, chunk))
-        
+    system_tokens = len(tokenizer.encode(SYSTEM_PROMPT))
+
+    def extract_chunk(chunk):
+        # Size the chunk as batching does, and as actually sent: everything in
+        # the prompt except the document itself
+        schema_tokens = sum(prop_token_counts.get(p, 0) for p in chunk.get('properties', {}))
+        chunk_tokens = system_tokens + len(tokenizer.encode(build_extract_prompt(chunk)))
+
+        # Feed the call's latency and token usage back to the planner
+        def record_call(latency, usage, success):
+            planner.record(
+                model,
+                latency,
+                prompt_tokens=usage.prompt_tokens if usage is not None else None,
+                completion_tokens=usage.completion_tokens if usage is not None else None,
+                chunk_tokens=chunk_tokens,
+                schema_tokens=schema_tokens,
+                success=success
+            )
+            if success and usage is not None:
+                planner.observe_document(fingerprint, max(usage.prompt_tokens - chunk_tokens, 0))
+
+        return extract_document(input_file, chunk, model=model, on_call=record_call, file_id=file_id)
+
+    # Upload a PDF once and share it, so repeating the document per chunk
+    # costs prompt tokens but not another upload
+    file_id = upload_document(input_file)
+
+    # Chunks are independent, so extract them in parallel (output keeps chunk order)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        chunked_output = list(executor.map(extract_chunk, generated_chunks))
     
     return chunked_output
 
@@ -78,7 +129,10 @@ app.add_middleware(
 @app.post("/format/", response_model=List[Dict[str, Any]])
 async def create_format_job(
     input_file: UploadFile = File(..., description="The input document file (any format)."),
-    schema_file: UploadFile = File(..., description="The schema definition file (.json).")
+    schema_file: UploadFile = File(..., description="The schema definition file (.json)."),
+    threshold: Optional[int] = Form(None, gt=0, description="Chunk token threshold. Chosen by the planner if omitted."),
+    model: str = Form(DEFAULT_MODEL, description=f"Model used for extraction. One of: {', '.join(SUPPORTED_MODELS)}."),
+    concurrency: int = Form(DEFAULT_CONCURRENCY, gt=0, le=MAX_CONCURRENCY, description="Max extraction calls in flight.")
 ):
     """
     Accepts an input file and a schema file, formats the document,
@@ -115,7 +169,7 @@ async def create_format_job(
 
         # 3. Call the core formatting function
         try:
-            results = format(input_file_path, schema_json)
+            results = format(input_file_path, schema_json, threshold=threshold, model=model, concurrency=concurrency)
             if results is None: # Handle case where format_documents might return None unexpectedly
                  raise HTTPException(status_code=500, detail="Formatting function returned an unexpected None value.")
             return results
@@ -132,6 +186,14 @@ async def create_format_job(
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
 
+@app.get("/planner/")
+async def get_planner():
+    """
+    Returns the latency model fitted by the chunk planner for each model
+    it has observed (None until enough calls have been recorded).
+    """
+    return planner.describe()
+
 @app.get("/", include_in_schema=False)
 async def root():
     return {"message": "Welcome to the beaver API."}
@@ -113,9 +113,49 @@ def get_all_dependencies(start_def_names, full_schema):
     return all_req_defs
 
 
+def get_property_token_count(prop_definition, full_schema, tokenizer):
+    """ Token count of a top-level property with its $refs resolved. """
+    resolve_cache_for_counting.clear() # Use fresh cache for each property's count resolution
+    resolved_definition = resolve_refs_for_counting(prop_definition, full_schema)
+    return get_token_count(resolved_definition, tokenizer)
+
+
+def batch_properties(property_names, prop_token_counts, threshold):
+    """
+    Greedily groups properties (in the given order) into batches whose
+    summed token count stays within `threshold`. A property that alone
+    exceeds the threshold gets a batch of its own.
+    """
+    property_batches = []
+    current_batch = []
+    current_batch_tokens = 0
+
+    for prop_name in property_names:
+        token_count = prop_token_counts[prop_name]
+
+        # Decide if current prop starts a new batch
+        if current_batch and (current_batch_tokens + token_count > threshold):
+             property_batches.append(current_batch)
+             logging.debug(f"  Finalized Batch (Props): {current_batch} ({current_batch_tokens} tokens)")
+             current_batch = [prop_name]
+             current_batch_tokens = token_count
+        else:
+             # Add to current batch
+             current_batch.append(prop_name)
+             current_batch_tokens += token_count
+
+    # Add the last batch
+    if current_batch:
+        property_batches.append(current_batch)
+        logging.debug(f"  Finalized Batch (Props): {current_batch} ({current_batch_tokens} tokens)")
+
+    return property_batches
+
+
 # --- Main Chunking Function ---
 
-def create_schema_chunks(schema, tokenizer_name="cl100k_base", threshold=10000, sort_props=True):
+def create_schema_chunks(schema, tokenizer_name="cl100k_base", threshold=10000, sort_props=True,
+                         prop_token_counts=None):
     """
     Creates schema chunks based on top-level properties, batched by token count.
     Each chunk includes the properties and all necessary definitions.
@@ -125,6 +165,9 @@ def create_schema_chunks(schema, tokenizer_name="cl100k_base", threshold=10000,
         tokenizer_name (str): Name of the tiktoken tokenizer.
         threshold (int): Max token count per batch (for properties).
         sort_props (bool): Sort properties alphabetically before batching.
+        prop_token_counts (dict | None): Precomputed resolved token count per
+                    top-level property (see `get_property_token_count`).
+                    Skips tokenizing those properties again when given.
 
     Returns:
         list[dict]: A list of minimal schema chunks (as Python dicts).
@@ -142,24 +185,25 @@ def create_schema_chunks(schema, tokenizer_name="cl100k_base", threshold=10000,
         logging.warning("Schema is missing a 'definitions' object. Refs may not resolve.")
         schema['definitions'] = {} # Ensure it exists for lookups
 
-    try:
-        tokenizer = tiktoken.get_encoding(tokenizer_name)
-    except Exception as e:
-        logging.error(f"Failed to initialize tokenizer '{tokenizer_name}': {e}")
-        return []
-
     top_level_props_defs = schema['properties']
-    prop_token_counts = {}
+    # Reuse precomputed counts (copied, so the caller's dict isn't modified)
+    prop_token_counts = dict(prop_token_counts or {})
+    tokenizer = None
     prop_direct_dependencies = {} # Store direct dependencies found for each prop
 
     logging.info("Step 1: Calculating token counts and direct dependencies for top-level properties...")
     # 1. Calculate resolved token count and find direct dependencies for each prop
     for prop_name, prop_definition in top_level_props_defs.items():
         # --- Token Count ---
-        resolve_cache_for_counting.clear() # Use fresh cache for each property's count resolution
-        resolved_definition = resolve_refs_for_counting(prop_definition, schema)
-        token_count = get_token_count(resolved_definition, tokenizer)
-        prop_token_counts[prop_name] = token_count
+        if prop_name not in prop_token_counts:
+            if tokenizer is None:
+                try:
+                    tokenizer = tiktoken.get_encoding(tokenizer_name)
+                except Exception as e:
+                    logging.error(f"Failed to initialize tokenizer '{tokenizer_name}': {e}")
+                    return []
+            prop_token_counts[prop_name] = get_property_token_count(prop_definition, schema, tokenizer)
+        token_count = prop_token_counts[prop_name]
         logging.debug(f"  - Property '{prop_name}': {token_count} tokens (resolved).")
         if token_count > threshold:
              logging.warning(f"    Property '{prop_name}' ({token_count} tokens) "
@@ -172,32 +216,11 @@ def create_schema_chunks(schema, tokenizer_name="cl100k_base", threshold=10000,
 
     logging.info("Step 2: Batching properties based on token counts...")
     # 2. Batch properties based on token counts
-    property_batches = []
-    current_batch = []
-    current_batch_tokens = 0
-
     property_names = list(top_level_props_defs.keys())
     if sort_props:
         property_names.sort()
 
-    for prop_name in property_names:
-        token_count = prop_token_counts[prop_name]
-
-        # Decide if current prop starts a new batch
-        if current_batch and (current_batch_tokens + token_count > threshold):
-             property_batches.append(current_batch)
-             logging.debug(f"  Finalized Batch (Props): {current_batch} ({current_batch_tokens} tokens)")
-             current_batch = [prop_name]
-             current_batch_tokens = token_count
-        else:
-             # Add to current batch
-             current_batch.append(prop_name)
-             current_batch_tokens += token_count
-
-    # Add the last batch
-    if current_batch:
-        property_batches.append(current_batch)
-        logging.debug(f"  Finalized Batch (Props): {current_batch} ({current_batch_tokens} tokens)")
+    property_batches = batch_properties(property_names, prop_token_counts, threshold)
 
     logging.info(f"Created {len(property_batches)} property batches.")
     logging.info("Step 3: Generating minimal schema chunks for each batch...")
@@ -0,0 +1,224 @@
+import random
+
+import pytest
+
+import chunk_planner
+from chunk_planner import ChunkPlanner, _ols2, document_fingerprint
+
+
+# 40 properties of 500 tokens each: 20000 schema tokens in total
+PROP_TOKEN_COUNTS = {f"prop_{i:02d}": 500 for i in range(40)}
+
+
+def make_fitted(base=0.0, prefill=0.0, decode=0.0, chunk_base=0.0, chunk_per_schema_token=1.0,
+                output_base=0.0, output_per_schema_token=0.0, failure_rate=0.0):
+    return {
+        "base_latency": base,
+        "prefill_latency_per_token": prefill,
+        "decode_latency_per_token": decode,
+        "chunk_base_tokens": chunk_base,
+        "chunk_tokens_per_schema_token": chunk_per_schema_token,
+        "output_base_tokens": output_base,
+        "output_tokens_per_schema_token": output_per_schema_token,
+        "failure_rate": failure_rate,
+        "samples": 100,
+    }
+
+
+class WordTokenizer:
+    """ Stand-in for a tiktoken encoding: one token per whitespace-separated word. """
+
+    def encode(self, text):
+        return text.split()
+
+
+def record_synthetic(planner, model="m", n=50, seed=0):
+    """
+    latency = 1 + 1e-4 * prompt + 1e-2 * completion, where the prompt carries
+    chunk = 300 + 1.5 * schema tokens and completion = 20 + 0.5 * schema tokens
+    """
+    rng = random.Random(seed)
+    for _ in range(n):
+        document_tokens = rng.randint(1000, 20000)
+        schema_tokens = rng.randint(500, 10000)
+        chunk_tokens = 300 + 1.5 * schema_tokens
+        prompt_tokens = document_tokens + chunk_tokens
+        completion_tokens = 20 + 0.5 * schema_tokens
+        latency = 1 + 1e-4 * prompt_tokens + 1e-2 * completion_tokens
+        planner.record(model, latency, prompt_tokens, completion_tokens, chunk_tokens, schema_tokens)
+
+
+def test_fit_needs_min_successful_samples():
+    planner = ChunkPlanner(min_samples=3)
+    planner.record("m", 1.0, 100, 10, 50, 40)
+    planner.record("m", 1.0, 200, 10, 50, 40)
+    # Failed calls don't count towards min_samples
+    planner.record("m", 5.0, success=False)
+    assert planner.fit("m") is None
+    assert planner.fit("unknown") is None
+
+    planner.record("m", 1.0, 300, 10, 50, 40)
+    fitted = planner.fit("m")
+    assert fitted is not None
+    assert fitted["failure_rate"] == pytest.approx(0.25)
+    assert fitted["samples"] == 4
+
+
+def test_fit_recovers_prefill_and_decode_costs():
+    planner = ChunkPlanner()
+    record_synthetic(planner)
+    fitted = planner.fit("m")
+    assert fitted["base_latency"] == pytest.approx(1.0)
+    assert fitted["prefill_latency_per_token"] == pytest.approx(1e-4)
+    assert fitted["decode_latency_per_token"] == pytest.approx(1e-2)
+    assert fitted["chunk_base_tokens"] == pytest.approx(300)
+    assert fitted["chunk_tokens_per_schema_token"] == pytest.approx(1.5)
+    assert fitted["output_base_tokens"] == pytest.approx(20)
+    assert fitted["output_tokens_per_schema_token"] == pytest.approx(0.5)
+    assert fitted["failure_rate"] == 0
+
+
+def test_fit_clamps_negative_coefficients():
+    planner = ChunkPlanner(min_samples=3)
+    # Latency falls as prompts grow and output shrinks as chunks grow
+    for tokens, latency in [(100, 5.0), (200, 4.0), (300, 3.0), (400, 2.0)]:
+        planner.record("m", latency, tokens, 100, 1000 - tokens, 1000 - tokens)
+    fitted = planner.fit("m")
+    assert fitted["prefill_latency_per_token"] == 0
+    assert fitted["decode_latency_per_token"] == 0
+    assert fitted["base_latency"] == pytest.approx(3.5)
+    assert fitted["output_tokens_per_schema_token"] == 0
+    assert fitted["output_base_tokens"] == pytest.approx(100)
+
+
+def test_ols2_falls_back_on_collinear_regressors():
+    x1s = [100, 200, 300, 400]
+    x2s = [2 * x for x in x1s]
+    ys = [1 + 0.01 * x for x in x1s]
+    intercept, b1, b2 = _ols2(x1s, x2s, ys)
+    assert b1 == 0 or b2 == 0
+    for x1, x2, y in zip(x1s, x2s, ys):
+        assert intercept + b1 * x1 + b2 * x2 == pytest.approx(y)
+
+
+def test_expected_latency_is_lpt_makespan():
+    planner = ChunkPlanner()
+    fitted = make_fitted(prefill=1.0)
+    # Longest first onto the least loaded of 2 workers: [3, 2, 2] and [3, 2]
+    assert planner.expected_latency(fitted, 0, [2, 3, 2, 3, 2], 2) == pytest.approx(7)
+    assert planner.expected_latency(fitted, 0, [2, 3, 2, 3, 2], 1) == pytest.approx(12)
+    assert planner.expected_latency(fitted, 0, [2, 3, 2, 3, 2], 10) == pytest.approx(3)
+    # The document is part of every call's prompt
+    assert planner.expected_latency(fitted, 10, [2, 3], 2) == pytest.approx(13)
+
+
+def test_expected_latency_charges_failures_per_chunk():
+    planner = ChunkPlanner()
+    fitted = make_fitted(base=1.0, failure_rate=0.5)
+    # Every chunk must succeed: (1 - 0.5) ** n
+    assert planner.expected_latency(fitted, 0, [1], 4) == pytest.approx(2)
+    assert planner.expected_latency(fitted, 0, [1, 1, 1], 4) == pytest.approx(8)
+
+
+def test_choose_threshold_defaults_without_enough_samples():
+    planner = ChunkPlanner(default_threshold=1234)
+    assert planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, 4) == 1234
+    record_synthetic(planner)
+    assert planner.choose_threshold("m", {}, 5000, 4) == 1234
+
+
+def test_choose_threshold_considers_single_chunk():
+    planner = ChunkPlanner(candidate_thresholds=[500])
+    record_synthetic(planner)
+    # Sequential calls only repeat the document, so one chunk of everything wins
+    assert planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, 1) == 20000
+
+
+def test_choose_threshold_breaks_ties_towards_fewer_chunks():
+    planner = ChunkPlanner(candidate_thresholds=[500, 1000, 5000], min_samples=3)
+    # Latency doesn't depend on tokens, so with enough workers every
+    # candidate is equally fast
+    for tokens in (100, 200, 300):
+        planner.record("m", 2.0, tokens, 10, tokens, tokens)
+    assert planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, 100) == 20000
+
+
+def test_concurrency_changes_chosen_threshold():
+    planner = ChunkPlanner()
+    record_synthetic(planner)
+    thresholds = [planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, concurrency)
+                  for concurrency in (1, 4, 16)]
+    # More workers make smaller chunks worthwhile
+    assert thresholds[0] > thresholds[1] > thresholds[2]
+
+
+def test_failure_rate_changes_chosen_threshold():
+    planner = ChunkPlanner()
+    record_synthetic(planner)
+    reliable = planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, 16)
+    for _ in range(20):
+        planner.record("m", 1.0, success=False)
+    flaky = planner.choose_threshold("m", PROP_TOKEN_COUNTS, 5000, 16)
+    # Each extra chunk is another chance to fail the request
+    assert flaky > reliable
+
+
+def write_file(tmp_path, name, content):
+    path = tmp_path / name
+    if isinstance(content, bytes):
+        path.write_bytes(content)
+    else:
+        path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_document_fingerprint_identifies_content(tmp_path):
+    first = write_file(tmp_path, "a.md", "same words here")
+    second = write_file(tmp_path, "b.md", "same words here")
+    other = write_file(tmp_path, "c.pdf", b"%PDF different")
+    assert document_fingerprint(first)[0] == document_fingerprint(second)[0]
+    assert document_fingerprint(first)[1:] == ("text/markdown", 15)
+    assert document_fingerprint(other)[0] != document_fingerprint(first)[0]
+    assert document_fingerprint(other)[1] == "application/pdf"
+
+
+def test_estimate_document_tokens_for_new_documents(tmp_path):
+    planner = ChunkPlanner()
+    text = write_file(tmp_path, "doc.md", "one two three four")
+    binary = write_file(tmp_path, "doc.bin", b"\xff\xfe" * 40)
+    pdf = write_file(tmp_path, "doc.pdf", b"x" * 800)
+    # Text is tokenized locally
+    assert planner.estimate_document_tokens(document_fingerprint(text), text, WordTokenizer()) == 4
+    # Non-UTF-8 files and PDFs fall back to bytes per token
+    assert planner.estimate_document_tokens(document_fingerprint(binary), binary, WordTokenizer()) == 10
+    assert planner.estimate_document_tokens(document_fingerprint(pdf), pdf, WordTokenizer()) == 100
+
+
+def test_estimate_document_tokens_uses_observations(tmp_path):
+    planner = ChunkPlanner()
+    seen = write_file(tmp_path, "seen.pdf", b"x" * 1000)
+    unseen = write_file(tmp_path, "unseen.pdf", b"y" * 3000)
+    seen_fingerprint = document_fingerprint(seen)
+    planner.observe_document(seen_fingerprint, 40)
+    planner.observe_document(seen_fingerprint, 60)
+    # A known document gets the mean of its observations
+    assert planner.estimate_document_tokens(seen_fingerprint, seen, WordTokenizer()) == 50
+    # A new PDF is sized with the bytes per token observed for PDFs
+    assert planner.estimate_document_tokens(document_fingerprint(unseen), unseen, WordTokenizer()) == 150
+    assert planner.describe()["bytes_per_token"] == {"application/pdf": 20}
+
+
+def test_document_cache_drops_least_recently_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_planner, "MAX_DOCUMENTS", 2)
+    planner = ChunkPlanner()
+    paths = [write_file(tmp_path, f"{name}.md", name) for name in ("first", "second", "third")]
+    fingerprints = [document_fingerprint(path) for path in paths]
+    planner.observe_document(fingerprints[0], 100)
+    planner.observe_document(fingerprints[1], 200)
+    # Looking up the first document makes the second the least recently used
+    assert planner.estimate_document_tokens(fingerprints[0], paths[0], WordTokenizer()) == 100
+    planner.observe_document(fingerprints[2], 300)
+    assert planner.estimate_document_tokens(fingerprints[0], paths[0], WordTokenizer()) == 100
+    assert planner.estimate_document_tokens(fingerprints[2], paths[2], WordTokenizer()) == 300
+    # Evicted, so it is tokenized again
+    assert planner.estimate_document_tokens(fingerprints[1], paths[1], WordTokenizer()) == 1
@@ -0,0 +1,162 @@
+import os
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+import tiktoken
+
+import doc_parse
+import main
+from chunk_planner import ChunkPlanner
+from llm import SYSTEM_PROMPT
+
+
+TESTCASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testcases")
+GA_DOCUMENT = os.path.join(TESTCASES, "ga.md")
+GA_SCHEMA = os.path.join(TESTCASES, "ga.json")
+
+
+class WordTokenizer:
+    """ Stand-in for a tiktoken encoding: one token per whitespace-separated word. """
+
+    def encode(self, text):
+        return text.split()
+
+
+def count_tokens(text):
+    return len(WordTokenizer().encode(text))
+
+
+class FakeGPT:
+    """
+    Stands in for llm.gpt_file. Reports the prompt tokens a provider would
+    count (system message, instructions with the chunk, and the document)
+    through `on_call`, and records what it was called with.
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, file_path, model="gpt-4.1", on_call=None, file_id=None):
+        with self._lock:
+            self.calls.append({"prompt": prompt, "model": model, "file_id": file_id})
+        if self.fail:
+            on_call(0.5, None, False)
+            raise RuntimeError("API down")
+
+        with open(file_path, "r", encoding="utf-8") as f:
+            document_tokens = count_tokens(f.read())
+        usage = SimpleNamespace(
+            prompt_tokens=count_tokens(SYSTEM_PROMPT) + count_tokens(prompt) + document_tokens,
+            completion_tokens=50,
+        )
+        on_call(1.0, usage, True)
+        return {"prompt_tokens": usage.prompt_tokens}
+
+
+@pytest.fixture
+def planner(monkeypatch):
+    planner = ChunkPlanner()
+    monkeypatch.setattr(main, "planner", planner)
+    monkeypatch.setattr(tiktoken, "get_encoding", lambda name: WordTokenizer())
+    monkeypatch.setattr(main, "upload_document", lambda file_path: None)
+    return planner
+
+
+@pytest.fixture
+def fake_gpt(monkeypatch):
+    fake = FakeGPT()
+    monkeypatch.setattr(doc_parse, "gpt_file", fake)
+    return fake
+
+
+def load_schema():
+    with open(GA_SCHEMA) as f:
+        return json.load(f)
+
+
+def test_format_records_every_call(planner, fake_gpt):
+    results = main.format(GA_DOCUMENT, load_schema(), threshold=50)
+    assert len(results) == len(fake_gpt.calls) > 1
+
+    samples = list(planner._samples["gpt-4.1"])
+    assert len(samples) == len(fake_gpt.calls)
+    for latency, prompt_tokens, completion_tokens, chunk_tokens, schema_tokens, success in samples:
+        assert success
+        assert completion_tokens == 50
+        assert 0 < schema_tokens < chunk_tokens < prompt_tokens
+
+
+def test_observed_document_size_matches_tokenized_text(planner, fake_gpt):
+    with open(GA_DOCUMENT, encoding="utf-8") as f:
+        document_tokens = count_tokens(f.read())
+    fingerprint = main.document_fingerprint(GA_DOCUMENT)
+    assert planner.estimate_document_tokens(fingerprint, GA_DOCUMENT, WordTokenizer()) == document_tokens
+
+    # Whatever the chunking, what's left of the prompt after the chunk is the document
+    for threshold in (50, 200, 100000):
+        main.format(GA_DOCUMENT, load_schema(), threshold=threshold)
+        assert planner.estimate_document_tokens(fingerprint, GA_DOCUMENT, WordTokenizer()) == document_tokens
+
+
+def test_threshold_override_skips_planner(planner, fake_gpt, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("planner consulted despite an explicit threshold")
+    monkeypatch.setattr(planner, "choose_threshold", fail)
+    main.format(GA_DOCUMENT, load_schema(), threshold=100000)
+    assert len(fake_gpt.calls) == 1
+
+
+def test_planner_chooses_threshold_by_default(planner, fake_gpt, monkeypatch):
+    chosen = []
+    def choose_threshold(model, prop_token_counts, document_tokens, concurrency):
+        chosen.append((model, concurrency))
+        return 100000
+    monkeypatch.setattr(planner, "choose_threshold", choose_threshold)
+    main.format(GA_DOCUMENT, load_schema(), model="gpt-4o", concurrency=2)
+    assert chosen == [("gpt-4o", 2)]
+    assert [call["model"] for call in fake_gpt.calls] == ["gpt-4o"]
+
+
+def test_unsupported_model_is_rejected(planner, fake_gpt):
+    with pytest.raises(ValueError, match="Unsupported model"):
+        main.format(GA_DOCUMENT, load_schema(), model="not-a-model")
+    assert fake_gpt.calls == []
+    assert planner.describe()["models"] == {}
+
+
+@pytest.mark.parametrize("requested, expected", [(0, 1), (3, 3), (10000, main.MAX_CONCURRENCY)])
+def test_concurrency_is_clamped(planner, fake_gpt, monkeypatch, requested, expected):
+    workers = []
+    executor = main.concurrent.futures.ThreadPoolExecutor
+
+    def record_executor(max_workers):
+        workers.append(max_workers)
+        return executor(max_workers=max_workers)
+    monkeypatch.setattr(main.concurrent.futures, "ThreadPoolExecutor", record_executor)
+    main.format(GA_DOCUMENT, load_schema(), threshold=50, concurrency=requested)
+    assert workers == [expected]
+
+
+def test_failed_calls_are_recorded(planner, monkeypatch):
+    monkeypatch.setattr(doc_parse, "gpt_file", FakeGPT(fail=True))
+    with pytest.raises(RuntimeError):
+        main.format(GA_DOCUMENT, load_schema(), threshold=100000)
+    samples = list(planner._samples["gpt-4.1"])
+    assert len(samples) == 1 and not samples[0][-1]
+    assert planner._documents == {}
+
+
+def test_document_is_uploaded_once(planner, fake_gpt, monkeypatch):
+    uploads = []
+    def upload_document(file_path):
+        uploads.append(file_path)
+        return "file-123"
+    monkeypatch.setattr(main, "upload_document", upload_document)
+    main.format(GA_DOCUMENT, load_schema(), threshold=50)
+    assert uploads == [GA_DOCUMENT]
+    assert len(fake_gpt.calls) > 1
+    assert {call["file_id"] for call in fake_gpt.calls} == {"file-123"}